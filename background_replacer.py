@@ -11,32 +11,443 @@ Author: Radko Yordanov
 import os
 import sys
 import argparse
+import contextlib
+import logging
+import math
+import multiprocessing
+import threading
+from io import BytesIO, StringIO
+from functools import lru_cache
+from glob import iglob
+from itertools import chain, islice
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 import rawpy
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
 from rembg import remove, new_session
+from rembg.sessions import sessions_class
+
+logger = logging.getLogger(__name__)
+
+# Numba is optional: when installed, cross-channel color filters run as a
+# compiled per-pixel kernel instead of numpy float arrays
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# mozjpeg_lossless_optimization is optional: when installed, JPEG output is
+# re-encoded with mozjpeg's lossless Huffman/progressive optimizations
+try:
+    import mozjpeg_lossless_optimization
+    HAS_MOZJPEG = True
+except ImportError:
+    HAS_MOZJPEG = False
+
+# OpenCV is optional: when installed, small edge feathers use its SIMD
+# Gaussian blur instead of PIL's
+try:
+    import cv2
+    HAS_CV2 = True
+except ImportError:
+    HAS_CV2 = False
+
+
+# Common named colors accepted by --color
+NAMED_COLORS = {
+    'white': (255, 255, 255, 255),
+    'black': (0, 0, 0, 255),
+    'red': (255, 0, 0, 255),
+    'green': (0, 255, 0, 255),
+    'blue': (0, 0, 255, 255),
+    'yellow': (255, 255, 0, 255),
+    'cyan': (0, 255, 255, 255),
+    'magenta': (255, 0, 255, 255),
+}
+
+# Resampling filters selectable for background image resizing
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'bilinear': Image.Resampling.BILINEAR,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+# WebP encoder method per compression effort (6 is smallest but slowest)
+WEBP_METHODS = {'fast': 4, 'max': 6}
+
+# EXIF tag holding the camera orientation
+EXIF_ORIENTATION = 0x0112
+
+# rembg sessions sharing U2-Net preprocessing, which predict_masks can batch.
+# INT8 models run in rembg's U2netCustomSession and are left out: dynamic
+# quantization scales activations over the whole batch, so batched masks
+# would depend on which other images share the batch.
+U2NET_SESSIONS = ('U2netSession', 'U2netpSession', 'U2netHumanSegSession', 'SiluetaSession')
+U2NET_INPUT_SIZE = (320, 320)
+U2NET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+U2NET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# File extensions decoded with rawpy
+RAW_EXTENSIONS = ('.cr3', '.cr2', '.nef', '.arw', '.dng')
+
+# File extensions picked up when a directory is given as input
+INPUT_EXTENSIONS = RAW_EXTENSIONS + ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp')
+
+# Save options that keep the encoders from writing metadata, including what
+# Pillow would otherwise copy from image.info (e.g. the ICC profile for PNG)
+STRIPPED_METADATA = {'exif': b'', 'icc_profile': None, 'xmp': b''}
+
+# Output formats accepted by --format
+OUTPUT_FORMATS = ['PNG', 'JPG', 'JPEG', 'WEBP', 'AVIF']
+
+# Longest edge of the proxy image fed to the segmentation model
+PROXY_MAX_SIZE = 1024
+
+# Threads sharing one session in a serial run: decoding and encoding release
+# the GIL, so one file's I/O overlaps the next file's inference. More threads
+# only compete for ONNX Runtime's cores and hold more full-size images.
+OVERLAP_THREADS = 2
+
+# Held around calls into the parallel numba kernels. Numba's threading layer
+# must not be entered from two threads at once (the workqueue layer aborts),
+# and each kernel already uses every core.
+_KERNEL_LOCK = threading.Lock()
+
+# Resized copies of the background image kept for reuse, keyed by size, so
+# a batch of same-sized photos resizes the background only once
+BACKGROUND_CACHE_SIZE = 8
+
+# rembg sessions keyed by (model name, quantization), so each ONNX model is
+# loaded once per run
+_SESSION_CACHE = {}
+
+# Color filter presets expressed as a 3x3 channel-mixing matrix plus a
+# per-channel bias, so every preset is a single matmul and clip over the image.
+SEPIA = np.array([[0.393, 0.769, 0.189],
+                  [0.349, 0.686, 0.168],
+                  [0.272, 0.534, 0.131]], dtype=np.float32)
+
+NO_BIAS = np.zeros(3, dtype=np.float32)
+
+COLOR_FILTER_MATRICES = {
+    # Increase red and yellow tones, decrease blue
+    'warm': (np.diag([1.15, 1.08, 0.85]).astype(np.float32), NO_BIAS),
+    # Increase blue tones, decrease red
+    'cool': (np.diag([0.85, 0.95, 1.15]).astype(np.float32), NO_BIAS),
+    'cold': (np.diag([0.85, 0.95, 1.15]).astype(np.float32), NO_BIAS),
+    # Classic sepia tone
+    'sepia': (SEPIA, NO_BIAS),
+    # Vintage film look: sepia-like tone with lifted blacks
+    'vintage': (np.diag([0.9, 0.85, 0.7]).astype(np.float32),
+                np.array([30, 20, 10], dtype=np.float32)),
+    # Increase all colors slightly for vibrant look
+    'vibrant': (np.diag([1.12, 1.12, 1.12]).astype(np.float32), NO_BIAS),
+    # Decrease saturation by blending 30% of the channel mean into each channel
+    'muted': ((np.eye(3) * 0.7 + 0.1).astype(np.float32), NO_BIAS),
+}
+
+# Presets whose matrix is diagonal touch each channel independently and are
+# applied as 8-bit lookup tables on the PIL image, skipping the float path.
+PER_CHANNEL_FILTERS = ('warm', 'cool', 'cold', 'vintage', 'vibrant')
+
+IDENTITY_LUT = list(range(256))
+
+# Image rows per block when color filters fall back to float arithmetic
+FILTER_BLOCK_ROWS = 64
+
+# Largest feather radius blurred with OpenCV. Its true Gaussian kernel grows
+# with the radius, while PIL's box-blur approximation costs the same at any
+# radius and wins beyond roughly 10px.
+CV2_MAX_FEATHER = 8
+
+
+def _build_channel_lut(matrix, bias):
+    """Build a 768-entry RGB lookup table for a diagonal color matrix."""
+    levels = np.arange(256, dtype=np.float32)
+    return np.concatenate([
+        np.clip(levels * matrix[c, c] + bias[c], 0, 255).astype(np.uint8)
+        for c in range(3)
+    ]).tolist()
+
+
+COLOR_FILTER_LUTS = {
+    name: _build_channel_lut(*COLOR_FILTER_MATRICES[name])
+    for name in PER_CHANNEL_FILTERS
+}
+
+
+if HAS_NUMBA:
+    @njit(fastmath=True, cache=True)
+    def _mix_pixel(r, g, b, matrix, bias):
+        """Apply a 3x3 color matrix plus bias to one uint8 pixel."""
+        fr, fg, fb = np.float32(r), np.float32(g), np.float32(b)
+        r = np.uint8(min(max(matrix[0, 0] * fr + matrix[0, 1] * fg + matrix[0, 2] * fb + bias[0], 0.0), 255.0))
+        g = np.uint8(min(max(matrix[1, 0] * fr + matrix[1, 1] * fg + matrix[1, 2] * fb + bias[1], 0.0), 255.0))
+        b = np.uint8(min(max(matrix[2, 0] * fr + matrix[2, 1] * fg + matrix[2, 2] * fb + bias[2], 0.0), 255.0))
+        return r, g, b
+
+    @njit(cache=True)
+    def _saturate_pixel(r, g, b, factor):
+        """Scale the saturation of one uint8 pixel.
+
+        Blends the pixel with its grayscale value exactly as
+        ImageEnhance.Color does, using PIL's fixed-point luma conversion.
+        """
+        gray = np.float32((np.int32(r) * 19595 + np.int32(g) * 38470 + np.int32(b) * 7471 + 32768) >> 16)
+        r = np.uint8(min(max(gray + factor * (np.float32(r) - gray), 0.0), 255.0))
+        g = np.uint8(min(max(gray + factor * (np.float32(g) - gray), 0.0), 255.0))
+        b = np.uint8(min(max(gray + factor * (np.float32(b) - gray), 0.0), 255.0))
+        return r, g, b
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _mix_channels(img, matrix, bias):
+        """Apply a 3x3 color matrix plus bias in place to a uint8 RGB(A) array."""
+        height, width = img.shape[0], img.shape[1]
+        for y in prange(height):
+            for x in range(width):
+                img[y, x, 0], img[y, x, 1], img[y, x, 2] = _mix_pixel(
+                    img[y, x, 0], img[y, x, 1], img[y, x, 2], matrix, bias)
+
+    @njit(parallel=True, cache=True)
+    def _saturate(img, factor):
+        """Scale saturation in place on a uint8 RGB(A) array."""
+        height, width = img.shape[0], img.shape[1]
+        for y in prange(height):
+            for x in range(width):
+                img[y, x, 0], img[y, x, 1], img[y, x, 2] = _saturate_pixel(
+                    img[y, x, 0], img[y, x, 1], img[y, x, 2], factor)
+
+    @njit(cache=True)
+    def _adjust_pixel(r, g, b, channel_lut, matrix, bias, use_matrix, saturation):
+        """Apply a color filter and saturation to one pixel, as the separate stages do."""
+        r = channel_lut[0, r]
+        g = channel_lut[1, g]
+        b = channel_lut[2, b]
+        if use_matrix:
+            r, g, b = _mix_pixel(r, g, b, matrix, bias)
+        if saturation != 1.0:
+            r, g, b = _saturate_pixel(r, g, b, saturation)
+        return r, g, b
+
+    @njit(parallel=True, cache=True)
+    def _adjusted_histogram(fg, channel_lut, matrix, bias, use_matrix, saturation, bright_lut):
+        """Return the grayscale histogram of an RGBA array after _adjust_pixel and
+        bright_lut, without writing it.
+
+        Gray levels use PIL's fixed-point luma conversion, so the histogram
+        is the one image.convert('L').histogram() gives for the adjusted image.
+        """
+        height, width = fg.shape[0], fg.shape[1]
+        rows = np.zeros((height, 256), dtype=np.int32)
+        for y in prange(height):
+            for x in range(width):
+                r, g, b = _adjust_pixel(fg[y, x, 0], fg[y, x, 1], fg[y, x, 2],
+                                        channel_lut, matrix, bias, use_matrix, saturation)
+                gray = (np.int32(bright_lut[r]) * 19595 + np.int32(bright_lut[g]) * 38470
+                        + np.int32(bright_lut[b]) * 7471 + 32768) >> 16
+                rows[y, gray] += 1
+        return rows.sum(axis=0)
+
+    @njit(parallel=True, cache=True)
+    def _finish_pixels(fg, channel_lut, matrix, bias, use_matrix, saturation, tone_lut, bg, out):
+        """Adjust each pixel of an RGBA array and blend it over an opaque background.
+
+        bg is either a full-size RGB(A) array or a 1x1 array holding a solid
+        color; out is the RGB or RGBA output array.
+        """
+        height, width = fg.shape[0], fg.shape[1]
+        # A solid color is read from (0, 0) for every pixel. Both dimensions
+        # are checked, as a one-row foreground has a one-row background image.
+        step = 0 if bg.shape[0] == 1 and bg.shape[1] == 1 else 1
+        for y in prange(height):
+            by = y * step
+            for x in range(width):
+                bx = x * step
+                r, g, b = _adjust_pixel(fg[y, x, 0], fg[y, x, 1], fg[y, x, 2],
+                                        channel_lut, matrix, bias, use_matrix, saturation)
+                a = np.int32(fg[y, x, 3])
+                out[y, x, 0] = np.uint8((np.int32(tone_lut[r]) * a + np.int32(bg[by, bx, 0]) * (255 - a) + 127) // 255)
+                out[y, x, 1] = np.uint8((np.int32(tone_lut[g]) * a + np.int32(bg[by, bx, 1]) * (255 - a) + 127) // 255)
+                out[y, x, 2] = np.uint8((np.int32(tone_lut[b]) * a + np.int32(bg[by, bx, 2]) * (255 - a) + 127) // 255)
+                if out.shape[2] == 4:
+                    out[y, x, 3] = 255
+else:
+    _mix_channels = None
+    _saturate = None
+    _finish_pixels = None
+
+
+def get_raw_size(raw):
+    """Return the (width, height) rawpy will produce at full resolution."""
+    width, height = raw.sizes.width, raw.sizes.height
+    # Flip values 5 and 6 rotate the image by 90 degrees
+    if raw.sizes.flip in (5, 6):
+        width, height = height, width
+    return (width, height)
+
+
+def decode_image(file_path, width=None, height=None, scale=None, half_size=False):
+    """Read an image at the lowest resolution a planned resize still needs.
+
+    RAW files are demosaiced at half size and JPEG files are drafted at 1/2,
+    1/4 or 1/8 scale whenever the reduced image still covers the output size,
+    giving one decode-at-target-resolution policy for both kinds of input.
 
+    Args:
+        file_path: Path to input image
+        width: Planned output width in pixels
+        height: Planned output height in pixels
+        scale: Planned scale factor relative to the source size
+        half_size: Always decode RAW input at half resolution (fast previews)
 
-def read_cr3_image(file_path):
-    """Read CR3 (Canon RAW) file and convert to RGB image."""
-    print(f"Reading CR3 file: {file_path}")
-    with rawpy.imread(file_path) as raw:
-        rgb = raw.postprocess()
-    return Image.fromarray(rgb)
+    Returns:
+        Tuple of (PIL Image, source size a scale factor applies to)
+    """
+    file_path = Path(file_path)
 
+    if file_path.suffix.lower() in RAW_EXTENSIONS:
+        print(f"Reading CR3 file: {file_path}")
+        with rawpy.imread(str(file_path)) as raw:
+            source_size = get_raw_size(raw)
+            target_size = get_target_size(source_size, width, height, scale)
+            if half_size:
+                # An explicit preview decode becomes the source for scaling
+                source_size = (source_size[0] // 2, source_size[1] // 2)
+            elif target_size and all(s // 2 >= t for s, t in zip(source_size, target_size)):
+                half_size = True
+            if half_size:
+                print("  - Decoding at half size")
+            rgb = raw.postprocess(half_size=half_size)
+        return Image.fromarray(rgb), source_size
+
+    image = Image.open(file_path)
+
+    # rembg turns images upright from their EXIF orientation, so do the same
+    # here to keep the mask, resize targets and output in one orientation
+    rotated = image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8)
+    source_size = image.size[::-1] if rotated else image.size
+    target_size = get_target_size(source_size, width, height, scale)
+    if target_size and rotated:
+        target_size = target_size[::-1]
+    draft_image(image, target_size)
+    ImageOps.exif_transpose(image, in_place=True)
+    return image, source_size
+
+
+def get_target_size(size, width=None, height=None, scale=None):
+    """Return the smallest (width, height) box a resize of an image will need.
 
-def read_image(file_path):
-    """Read image file (supports CR3, JPG, PNG, etc.)."""
-    file_path = Path(file_path)
+    Args:
+        size: Source image size (width, height)
+        width: Target width in pixels
+        height: Target height in pixels
+        scale: Scale factor relative to the source size
+
+    Returns:
+        (width, height) tuple, or None when no resize is requested
+    """
+    if scale:
+        return (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+    if width or height:
+        # An unspecified dimension places no constraint on the decode size
+        return (width or 1, height or 1)
+    return None
+
+
+def draft_image(image, target_size):
+    """Let JPEG images decode at a reduced scale that still covers target_size.
 
-    if file_path.suffix.lower() in ['.cr3', '.cr2', '.nef', '.arw', '.dng']:
-        return read_cr3_image(str(file_path))
+    libjpeg can decode directly at 1/2, 1/4 or 1/8 resolution, skipping IDCT
+    work for pixels a later downscale would throw away. Other formats, and
+    targets larger than the image, are left untouched.
+    """
+    if target_size and image.format == 'JPEG':
+        image.draft('RGB', target_size)
+    return image
+
+
+def get_session(model, quant='fp32'):
+    """Return a rembg session for the model, loading it only on first use.
+
+    Args:
+        model: rembg model name
+        quant: Weight precision, 'fp32' or 'int8' (U2-Net family only)
+
+    Returns:
+        rembg session
+    """
+    session = _SESSION_CACHE.get((model, quant))
+    if session is not None:
+        return session
+
+    if quant == 'int8':
+        session = load_quantized_session(model)
     else:
-        return Image.open(file_path)
+        # Create session with specified model
+        try:
+            session = new_session(model)
+            print(f"  - Model loaded successfully")
+        except Exception as e:
+            if model == 'u2net':
+                raise
+            print(f"  - Warning: Could not load model '{model}': {e}")
+            print(f"  - Falling back to default model 'u2net'")
+            session = get_session('u2net')
+
+    _SESSION_CACHE[(model, quant)] = session
+    return session
 
 
-def remove_background(image, model='u2net', alpha_matting=False, mask_only=False):
+def load_quantized_session(model):
+    """Load an INT8 copy of a U2-Net family model, quantizing it on first use.
+
+    The weights are quantized with ONNX Runtime's dynamic quantization and
+    saved next to the downloaded FP32 model, then run through rembg's custom
+    U2-Net session, which shares the family's preprocessing.
+    """
+    session_class = next((c for c in sessions_class if c.name() == model), None)
+    if session_class is None or session_class.__name__ not in U2NET_SESSIONS:
+        print(f"  - Warning: INT8 is only supported for U2-Net models, using FP32 '{model}'")
+        return get_session(model)
+
+    model_path = Path(session_class.download_models())
+    quantized_path = model_path.with_suffix('.int8.onnx')
+    if not quantized_path.exists():
+        print(f"  - Quantizing {model} to INT8 (first use only)")
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:
+            print(f"  - Warning: Cannot quantize without the onnx package ({e}), using FP32 '{model}'")
+            return get_session(model)
+        # Write under a per-process name so parallel workers never load a
+        # partially written model
+        temp_path = quantized_path.with_suffix(f'.{os.getpid()}.tmp')
+        quantize_dynamic(str(model_path), str(temp_path), weight_type=QuantType.QInt8)
+        os.replace(temp_path, quantized_path)
+
+    session = new_session('u2net_custom', model_path=str(quantized_path))
+    print(f"  - Model loaded successfully (INT8)")
+    return session
+
+
+def segmentation_proxy(image):
+    """Return a copy of image downscaled to at most PROXY_MAX_SIZE pixels.
+
+    Images that already fit are returned as is, so callers can check
+    whether a proxy was made with ``proxy is image``.
+    """
+    if max(image.size) <= PROXY_MAX_SIZE:
+        return image
+    proxy = image.copy()
+    proxy.thumbnail((PROXY_MAX_SIZE, PROXY_MAX_SIZE), Image.Resampling.LANCZOS)
+    return proxy
+
+
+def remove_background(image, model='u2net', alpha_matting=False, mask_only=False,
+                      session=None, mask=None):
     """Remove background from image using AI model.
 
     Args:
@@ -45,42 +456,139 @@ def remove_background(image, model='u2net', alpha_matting=False, mask_only=False
                birefnet-general, birefnet-portrait, etc.)
         alpha_matting: Enable alpha matting for better edge refinement
         mask_only: Return only the mask without background removal
+        session: Preloaded rembg session (defaults to the cached one for model)
+        mask: Mask already predicted for this image (see predict_masks)
 
     Returns:
         PIL Image with transparent background or mask
     """
     print(f"Removing background using model: {model}")
-    if alpha_matting:
+    if mask is not None:
+        print("  - Using mask from batched inference")
+    elif alpha_matting:
         print("  - Alpha matting enabled for edge refinement")
 
-    # Convert PIL Image to bytes
-    import io
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
+    if session is None and mask is None:
+        session = get_session(model)
+
+    # Alpha matting refines the cutout itself from a full-resolution trimap,
+    # so it is left to rembg. rembg skips matting for mask output, so a
+    # mask-only run takes the mask path below either way.
+    if mask is None and alpha_matting and not mask_only:
+        return remove(image, session=session, alpha_matting=True)
+
+    if mask is None:
+        # Segmentation models run at 1024px or less internally, so large
+        # images are segmented from a downscaled proxy and only the mask is
+        # upscaled. rembg accepts and returns PIL images directly.
+        proxy = segmentation_proxy(image)
+        if proxy is not image:
+            print(f"  - Segmenting {PROXY_MAX_SIZE}px proxy of {image.size[0]}x{image.size[1]} image")
+        mask = remove(proxy, session=session, only_mask=True)
+        if proxy is not image:
+            mask = mask.resize(image.size, Image.Resampling.LANCZOS)
+
+    if mask_only:
+        return mask
+
+    # Every path builds the cutout the same way, keeping the original colors
+    # under the mask as alpha, so edges do not depend on the image size or on
+    # batching
+    result = image.convert('RGBA')
+    result.putalpha(mask)
+    return result
+
+
+def supports_batching(session):
+    """Check whether a rembg session can segment several images in one run.
+
+    Only the U2-Net family shares a known preprocessing (320x320 input,
+    ImageNet normalization), and the ONNX model must have a dynamic batch
+    dimension.
+    """
+    if type(session).__name__ not in U2NET_SESSIONS:
+        return False
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int)
 
-    # Create session with specified model
-    try:
-        session = new_session(model)
-        print(f"  - Model loaded successfully")
-    except Exception as e:
-        print(f"  - Warning: Could not load model '{model}': {e}")
-        print(f"  - Falling back to default model 'u2net'")
-        session = new_session('u2net')
-
-    # Remove background with options
-    output = remove(
-        img_byte_arr,
-        session=session,
-        alpha_matting=alpha_matting,
-        only_mask=mask_only
-    )
 
-    # Convert back to PIL Image
-    return Image.open(io.BytesIO(output))
+def predict_masks(images, session):
+    """Predict segmentation masks for several images.
 
+    Batchable sessions run every image through a single ONNX Runtime call,
+    reproducing rembg's U2-Net pre- and post-processing on the same proxy
+    remove_background() segments, so batched and single masks match. Other
+    sessions get no masks and are segmented one at a time by
+    remove_background().
 
-def resize_image(image, width=None, height=None, scale=None, maintain_aspect=True):
+    Args:
+        images: List of PIL Images
+        session: rembg session
+
+    Returns:
+        List of grayscale PIL mask images, one per input at its size, or
+        None for each image left to remove_background()
+    """
+    if len(images) < 2 or not supports_batching(session):
+        return [None] * len(images)
+
+    print(f"  - Segmenting {len(images)} images in one batch")
+    proxies = [segmentation_proxy(image) for image in images]
+    width, height = U2NET_INPUT_SIZE
+    batch = np.empty((len(images), 3, height, width), dtype=np.float32)
+    for i, proxy in enumerate(proxies):
+        pixels = np.asarray(proxy.convert('RGB').resize(U2NET_INPUT_SIZE, Image.Resampling.LANCZOS),
+                            dtype=np.float32)
+        pixels /= max(pixels.max(), 1e-6)
+        pixels -= U2NET_MEAN
+        pixels /= U2NET_STD
+        batch[i] = pixels.transpose(2, 0, 1)
+
+    inner_session = session.inner_session
+    predictions = inner_session.run(None, {inner_session.get_inputs()[0].name: batch})[0][:, 0]
+
+    masks = []
+    for image, proxy, prediction in zip(images, proxies, predictions):
+        # Stretch each prediction to the full 0-1 range, as rembg does
+        low, high = prediction.min(), prediction.max()
+        prediction = (prediction - low) / max(high - low, 1e-6)
+        mask = Image.fromarray((prediction * 255).astype(np.uint8), 'L')
+        mask = mask.resize(proxy.size, Image.Resampling.LANCZOS)
+        if proxy is not image:
+            mask = mask.resize(image.size, Image.Resampling.LANCZOS)
+        masks.append(mask)
+    return masks
+
+
+def fit_size(size, width, height):
+    """Size that fits within width x height, as Image.thumbnail() picks it.
+
+    Each scaled dimension is rounded to whichever neighbouring integer keeps
+    the aspect ratio closest, so this can differ from round() by a pixel.
+
+    Args:
+        size: (width, height) of the source image
+        width: Maximum width in pixels
+        height: Maximum height in pixels
+
+    Returns:
+        (width, height) tuple, never larger than size
+    """
+    if width >= size[0] and height >= size[1]:
+        return size
+
+    aspect = size[0] / size[1]
+    if width / height >= aspect:
+        candidates = (math.floor(height * aspect), math.ceil(height * aspect))
+        width = min(candidates, key=lambda n: abs(aspect - n / height))
+    else:
+        candidates = (math.floor(width / aspect), math.ceil(width / aspect))
+        height = min(candidates, key=lambda n: 0 if n == 0 else abs(aspect - width / n))
+    return max(width, 1), max(height, 1)
+
+
+def resize_image(image, width=None, height=None, scale=None, maintain_aspect=True,
+                 source_size=None, resample='lanczos'):
     """Resize image with various options.
 
     Args:
@@ -89,6 +597,9 @@ def resize_image(image, width=None, height=None, scale=None, maintain_aspect=Tru
         height: Target height in pixels (None to auto-calculate)
         scale: Scale factor (e.g., 0.5 for 50%, 2.0 for 200%)
         maintain_aspect: Maintain aspect ratio when width or height specified
+        source_size: Size the scale factor applies to, when the image was
+                     decoded at reduced resolution (defaults to image size)
+        resample: Resampling filter name from RESAMPLE_FILTERS
 
     Returns:
         Resized PIL Image
@@ -97,16 +608,22 @@ def resize_image(image, width=None, height=None, scale=None, maintain_aspect=Tru
 
     if scale:
         # Scale based on factor
-        new_width = int(original_size[0] * scale)
-        new_height = int(original_size[1] * scale)
-        print(f"  - Resizing by scale {scale}: {original_size[0]}x{original_size[1]} -> {new_width}x{new_height}")
+        base_size = source_size or original_size
+        new_width = int(base_size[0] * scale)
+        new_height = int(base_size[1] * scale)
+        print(f"  - Resizing by scale {scale}: {base_size[0]}x{base_size[1]} -> {new_width}x{new_height}")
     elif width and height:
         # Both dimensions specified
         if maintain_aspect:
-            # Fit within dimensions, maintaining aspect ratio
-            image.thumbnail((width, height), Image.Resampling.LANCZOS)
-            print(f"  - Resizing to fit {width}x{height} (aspect maintained): {original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}")
-            return image
+            # Fit within dimensions, maintaining aspect ratio. Like thumbnail()
+            # this never enlarges, but it returns a new image instead of
+            # modifying the caller's in place.
+            new_width, new_height = fit_size(original_size, width, height)
+            print(f"  - Resizing to fit {width}x{height} (aspect maintained): {original_size[0]}x{original_size[1]} -> {new_width}x{new_height}")
+            if (new_width, new_height) == original_size:
+                return image
+            return image.resize((new_width, new_height), RESAMPLE_FILTERS[resample],
+                                reducing_gap=2.0)
         else:
             # Exact dimensions (may distort)
             new_width = width
@@ -128,7 +645,11 @@ def resize_image(image, width=None, height=None, scale=None, maintain_aspect=Tru
         # No resize needed
         return image
 
-    return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    if (new_width, new_height) == original_size:
+        # Already at the target size
+        return image
+
+    return image.resize((new_width, new_height), RESAMPLE_FILTERS[resample])
 
 
 def apply_color_filter(image, filter_type=None, saturation=1.0):
@@ -145,95 +666,111 @@ def apply_color_filter(image, filter_type=None, saturation=1.0):
     if not filter_type and saturation == 1.0:
         return image
 
-    filtered = image.copy()
+    # Every step below returns a new image, so the input is never modified
+    filtered = image
 
     # Apply preset color filters
     if filter_type:
         print(f"  - Applying {filter_type} filter")
 
-        # Convert to RGB for color operations (preserve alpha if exists)
-        has_alpha = filtered.mode == 'RGBA'
-        if has_alpha:
-            alpha = filtered.split()[3]
-            filtered = filtered.convert('RGB')
-
-        # Get image data as numpy array for color manipulation
-        img_array = np.array(filtered, dtype=np.float32)
-
-        if filter_type == 'warm':
-            # Increase red and yellow tones, decrease blue
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.15, 0, 255)  # Red +15%
-            img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.08, 0, 255)  # Green +8%
-            img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 0.85, 0, 255)  # Blue -15%
-
-        elif filter_type in ['cool', 'cold']:
-            # Increase blue tones, decrease red
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 0.85, 0, 255)  # Red -15%
-            img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 0.95, 0, 255)  # Green -5%
-            img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 1.15, 0, 255)  # Blue +15%
-
-        elif filter_type == 'sepia':
-            # Classic sepia tone
-            r = img_array[:, :, 0]
-            g = img_array[:, :, 1]
-            b = img_array[:, :, 2]
-
-            img_array[:, :, 0] = np.clip(r * 0.393 + g * 0.769 + b * 0.189, 0, 255)
-            img_array[:, :, 1] = np.clip(r * 0.349 + g * 0.686 + b * 0.168, 0, 255)
-            img_array[:, :, 2] = np.clip(r * 0.272 + g * 0.534 + b * 0.131, 0, 255)
-
-        elif filter_type == 'vintage':
-            # Vintage film look: slight sepia + reduced contrast + vignette effect
-            r = img_array[:, :, 0]
-            g = img_array[:, :, 1]
-            b = img_array[:, :, 2]
-
-            # Sepia-like tone
-            img_array[:, :, 0] = np.clip(r * 0.9 + 30, 0, 255)
-            img_array[:, :, 1] = np.clip(g * 0.85 + 20, 0, 255)
-            img_array[:, :, 2] = np.clip(b * 0.7 + 10, 0, 255)
-
-        elif filter_type == 'vibrant':
-            # Increase all colors slightly for vibrant look
-            img_array = np.clip(img_array * 1.12, 0, 255)
-
-        elif filter_type == 'muted':
-            # Decrease saturation and add slight gray
-            mean_val = np.mean(img_array, axis=2, keepdims=True)
-            img_array = img_array * 0.7 + mean_val * 0.3
-
-        # Convert back to PIL Image
-        filtered = Image.fromarray(img_array.astype(np.uint8), mode='RGB')
-
-        # Restore alpha channel if it existed
-        if has_alpha:
-            filtered = filtered.convert('RGBA')
-            filtered.putalpha(alpha)
+        if filter_type in COLOR_FILTER_LUTS:
+            # Per-channel presets map each byte through a lookup table,
+            # passing alpha through unchanged
+            lut = COLOR_FILTER_LUTS[filter_type]
+            if filtered.mode == 'RGBA':
+                lut = lut + IDENTITY_LUT
+            elif filtered.mode != 'RGB':
+                filtered = filtered.convert('RGB')
+            filtered = filtered.point(lut)
+        elif _mix_channels is not None and filtered.mode in ('RGB', 'RGBA'):
+            # Mix channels in one compiled pass, leaving alpha in place
+            img_array = np.array(filtered)
+            matrix, bias = COLOR_FILTER_MATRICES[filter_type]
+            with _KERNEL_LOCK:
+                _mix_channels(img_array, matrix, bias)
+            filtered = Image.fromarray(img_array, filtered.mode)
+        else:
+            if filtered.mode not in ('RGB', 'RGBA'):
+                filtered = filtered.convert('RGB')
+
+            # Get image data as numpy array and mix the color channels through
+            # a view, leaving any alpha channel in place. Rows are processed in
+            # blocks so the float32 temporaries stay small and cache-resident
+            # instead of spanning the whole image.
+            img_array = np.array(filtered)
+            rgb_view = img_array[:, :, :3]
+
+            matrix, bias = COLOR_FILTER_MATRICES[filter_type]
+            for start in range(0, rgb_view.shape[0], FILTER_BLOCK_ROWS):
+                block = rgb_view[start:start + FILTER_BLOCK_ROWS]
+                mixed = block.astype(np.float32) @ matrix.T
+                mixed += bias
+                np.clip(mixed, 0, 255, out=mixed)
+                block[...] = mixed
+
+            # Convert back to PIL Image
+            filtered = Image.fromarray(img_array, filtered.mode)
 
     # Apply saturation adjustment
     if saturation != 1.0:
         print(f"  - Adjusting saturation: {saturation}")
 
-        # Ensure RGB mode for color operations
-        has_alpha = filtered.mode == 'RGBA'
-        if has_alpha:
-            alpha = filtered.split()[3]
-            rgb = filtered.convert('RGB')
-        else:
-            rgb = filtered if filtered.mode == 'RGB' else filtered.convert('RGB')
-
-        enhancer = ImageEnhance.Color(rgb)
-        rgb = enhancer.enhance(saturation)
+        # ImageEnhance.Color keeps the alpha channel of RGBA images as is
+        if filtered.mode not in ('RGB', 'RGBA'):
+            filtered = filtered.convert('RGB')
 
-        if has_alpha:
-            filtered = rgb.convert('RGBA')
-            filtered.putalpha(alpha)
+        if _saturate is not None:
+            # Blend with gray in one compiled pass instead of building a
+            # grayscale copy of the image to blend against
+            img_array = np.array(filtered)
+            with _KERNEL_LOCK:
+                _saturate(img_array, np.float32(saturation))
+            filtered = Image.fromarray(img_array, filtered.mode)
         else:
-            filtered = rgb
+            enhancer = ImageEnhance.Color(filtered)
+            filtered = enhancer.enhance(saturation)
 
     return filtered
 
 
+def build_tone_lut(image, brightness=1.0, contrast=1.0, histogram=None):
+    """Build a 256-entry lookup table for brightness followed by contrast.
+
+    Follows ImageEnhance: brightness scales each value, and contrast blends
+    each value with the mean gray level of the brightened image. Like
+    ImageEnhance, that mean is taken from the grayscale histogram of the
+    brightened image, since rounding each pixel to gray does not commute
+    with brightening.
+
+    Args:
+        image: PIL Image the table will be applied to
+        brightness: Brightness factor (1.0=original)
+        contrast: Contrast factor (1.0=original)
+        histogram: Grayscale histogram of the brightened image, when the
+                   caller already has it
+
+    Returns:
+        List of 256 output levels
+    """
+    levels = np.arange(256, dtype=np.float32)
+    lut = np.clip(levels * np.float32(brightness), 0, 255).astype(np.uint8)
+
+    if contrast != 1.0:
+        if histogram is None:
+            # Only the histogram of the brightened copy is kept
+            brightened = image
+            if brightness != 1.0:
+                brightened = image.point(lut.tolist() * len(image.getbands()))
+            histogram = brightened.convert('L').histogram()
+        histogram = np.array(histogram, dtype=np.float64)
+        gray_mean = histogram @ levels / histogram.sum()
+        mean = np.float32(int(gray_mean + 0.5))
+        adjusted = mean + np.float32(contrast) * (lut.astype(np.float32) - mean)
+        lut = np.clip(adjusted, 0, 255).astype(np.uint8)
+
+    return lut.tolist()
+
+
 def enhance_image(image, brightness=1.0, contrast=1.0, sharpness=1.0, feather=0):
     """Apply image enhancements.
 
@@ -249,16 +786,20 @@ def enhance_image(image, brightness=1.0, contrast=1.0, sharpness=1.0, feather=0)
     """
     enhanced = image.copy()
 
-    # Apply enhancements if not default values
-    if brightness != 1.0:
-        print(f"  - Adjusting brightness: {brightness}")
-        enhancer = ImageEnhance.Brightness(enhanced)
-        enhanced = enhancer.enhance(brightness)
-
-    if contrast != 1.0:
-        print(f"  - Adjusting contrast: {contrast}")
-        enhancer = ImageEnhance.Contrast(enhanced)
-        enhanced = enhancer.enhance(contrast)
+    # Apply enhancements if not default values. Brightness and contrast are
+    # both per-pixel linear, so they compose into one lookup table pass.
+    if brightness != 1.0 or contrast != 1.0:
+        if brightness != 1.0:
+            print(f"  - Adjusting brightness: {brightness}")
+        if contrast != 1.0:
+            print(f"  - Adjusting contrast: {contrast}")
+        lut = build_tone_lut(enhanced, brightness, contrast)
+        bands = enhanced.getbands()
+        if 'A' in bands:
+            lut = lut * (len(bands) - 1) + IDENTITY_LUT
+        else:
+            lut = lut * len(bands)
+        enhanced = enhanced.point(lut)
 
     if sharpness != 1.0:
         print(f"  - Adjusting sharpness: {sharpness}")
@@ -268,48 +809,242 @@ def enhance_image(image, brightness=1.0, contrast=1.0, sharpness=1.0, feather=0)
     # Apply edge feathering (blur the alpha channel)
     if feather > 0 and enhanced.mode == 'RGBA':
         print(f"  - Feathering edges: {feather}px")
-        # Extract alpha channel
-        r, g, b, a = enhanced.split()
-        # Blur the alpha channel
-        a = a.filter(ImageFilter.GaussianBlur(radius=feather))
-        # Recombine
-        enhanced = Image.merge('RGBA', (r, g, b, a))
+        # Blur the alpha channel and put it back, leaving RGB untouched
+        alpha = enhanced.getchannel('A')
+        if HAS_CV2 and feather <= CV2_MAX_FEATHER:
+            # Match PIL, whose radius is the sigma: cover 3 sigma on each side
+            # and repeat the edge pixels rather than mirroring them
+            ksize = 2 * math.ceil(3 * feather) + 1
+            alpha = Image.fromarray(cv2.GaussianBlur(np.asarray(alpha), (ksize, ksize), sigmaX=feather,
+                                                     borderType=cv2.BORDER_REPLICATE))
+        else:
+            alpha = alpha.filter(ImageFilter.GaussianBlur(radius=feather))
+        enhanced.putalpha(alpha)
 
     return enhanced
 
 
-def replace_background(foreground_image, background_color=None, background_image=None):
-    """Replace background with solid color or another image."""
+def composite_over_opaque(foreground_image, background, mode='RGBA'):
+    """Composite an RGBA image over an opaque solid color or image.
+
+    Computes out = fg * a + bg * (1 - a) on 8-bit data with 16-bit
+    intermediates, which is what alpha_composite does for an opaque
+    background.
+
+    Args:
+        foreground_image: PIL Image in RGBA mode
+        background: Color tuple (R,G,B) or (R,G,B,A), or an RGB(A) PIL Image
+            of the same size; alpha is ignored
+        mode: Output mode, 'RGBA' (fully opaque alpha) or 'RGB'
+
+    Returns:
+        Opaque PIL Image in the requested mode
+    """
+    fg = np.asarray(foreground_image)
+    alpha = fg[:, :, 3:].astype(np.uint16)
+
+    if isinstance(background, Image.Image):
+        bg = np.asarray(background)[:, :, :3].astype(np.uint16)
+    else:
+        bg = np.array(background[:3], dtype=np.uint16)
+
+    rgb = fg[:, :, :3].astype(np.uint16)
+    rgb *= alpha
+    rgb += bg * (255 - alpha)
+    rgb += 127
+    rgb //= 255
+
+    result = np.empty(fg.shape[:2] + (len(mode),), dtype=np.uint8)
+    result[:, :, :3] = rgb
+    if mode == 'RGBA':
+        result[:, :, 3] = 255
+    return Image.fromarray(result, mode)
+
+
+@lru_cache(maxsize=1)
+def load_background(path):
+    """Decode a background image file once and reuse it for the whole batch."""
+    return Image.open(path).convert('RGBA')
 
-    # Ensure foreground has alpha channel
-    if foreground_image.mode != 'RGBA':
-        foreground_image = foreground_image.convert('RGBA')
 
-    # Create background
+@lru_cache(maxsize=BACKGROUND_CACHE_SIZE)
+def get_resized_background(path, size, resample='bilinear'):
+    """Return the background image file resized to size, cached per size."""
+    return load_background(path).resize(size, RESAMPLE_FILTERS[resample])
+
+
+def get_background(size, background_color=None, background_image=None,
+                   background_resample='bilinear'):
+    """Return the background to composite a foreground of the given size over.
+
+    The background image is mostly hidden behind the foreground, so it is
+    resized with a cheap filter (bilinear by default) rather than LANCZOS.
+    background_image may be a file path or an already opened RGBA image.
+
+    Returns:
+        Tuple of (background, opaque): an RGBA image of the given size, or
+        the color tuple for a solid color, and whether it is fully opaque
+    """
     if background_image:
-        print(f"Using background image: {background_image}")
-        bg = Image.open(background_image).convert('RGBA')
-        # Resize background to match foreground
-        bg = bg.resize(foreground_image.size, Image.Resampling.LANCZOS)
-    elif background_color:
+        if isinstance(background_image, Image.Image):
+            # Already decoded by the caller; resize it to match the foreground
+            bg = background_image.resize(size, RESAMPLE_FILTERS[background_resample])
+        else:
+            print(f"Using background image: {background_image}")
+            bg = get_resized_background(background_image, size, background_resample)
+        return bg, bg.getchannel('A').getextrema() == (255, 255)
+
+    if background_color:
         print(f"Using background color: {background_color}")
-        bg = Image.new('RGBA', foreground_image.size, background_color)
     else:
         # Default white background
-        bg = Image.new('RGBA', foreground_image.size, (255, 255, 255, 255))
+        background_color = (255, 255, 255, 255)
+    return background_color, len(background_color) == 3 or background_color[3] == 255
+
+
+def replace_background(foreground_image, background_color=None, background_image=None,
+                       background_resample='bilinear', output_mode='RGBA'):
+    """Replace background with solid color or another image.
+
+    Pass output_mode='RGB' when the result will be saved without alpha, so
+    the alpha channel is dropped here rather than by a later conversion.
+    """
+
+    # Ensure foreground has alpha channel
+    if foreground_image.mode != 'RGBA':
+        foreground_image = foreground_image.convert('RGBA')
+
+    bg, opaque = get_background(foreground_image.size, background_color, background_image,
+                                background_resample)
+
+    # An opaque background, which covers solid colors and nearly every photo,
+    # blends in a single numpy pass without alpha_composite's general
+    # two-alpha arithmetic or a full-size image for a solid color
+    if opaque:
+        return composite_over_opaque(foreground_image, bg, output_mode)
+    if not isinstance(bg, Image.Image):
+        bg = Image.new('RGBA', foreground_image.size, bg)
 
     # Composite foreground over background
     result = Image.alpha_composite(bg, foreground_image)
+    if output_mode != 'RGBA':
+        result = result.convert(output_mode)
 
     return result
 
 
+def finish_image(image, color_filter=None, saturation=1.0, brightness=1.0, contrast=1.0,
+                 feather=0, background_color=None, background_image=None,
+                 background_resample='bilinear', output_mode='RGBA'):
+    """Apply color adjustments and an opaque background in one pass.
+
+    Gives the same result as apply_color_filter, enhance_image (without
+    sharpening) and replace_background run in turn, but reads the cutout
+    and writes the output once instead of allocating an image per stage.
+    Feathering only touches alpha and is applied first; contrast needs the
+    mean gray level of the adjusted image, which a read-only histogram pass
+    supplies. Requires numba.
+
+    Args:
+        image: PIL Image with transparent background
+        color_filter: Filter preset (warm, cool, cold, sepia, vintage, vibrant, muted)
+        saturation: Saturation factor (1.0=original)
+        brightness: Brightness factor (1.0=original)
+        contrast: Contrast factor (1.0=original)
+        feather: Edge feathering amount in pixels (0=no feathering)
+        background_color: Background color tuple (R,G,B,A)
+        background_image: Background image path or opened RGBA image
+        background_resample: Filter for resizing the background image
+        output_mode: Output mode, 'RGBA' or 'RGB'
+
+    Returns:
+        Composited PIL Image, or None when the background is not opaque
+    """
+    # Leave translucent backgrounds to the staged path before resizing the
+    # background image, which that path would only do again
+    if has_transparent_background(background_color, background_image):
+        return None
+
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+
+    bg, _ = get_background(image.size, background_color, background_image,
+                           background_resample)
+
+    if feather > 0:
+        image = enhance_image(image, feather=feather)
+
+    # Per-channel presets become lookup tables and mixing presets a matrix,
+    # exactly as apply_color_filter applies them
+    channel_lut = np.array(IDENTITY_LUT * 3, dtype=np.uint8).reshape(3, 256)
+    matrix, bias = np.eye(3, dtype=np.float32), NO_BIAS
+    use_matrix = False
+    if color_filter:
+        print(f"  - Applying {color_filter} filter")
+        if color_filter in COLOR_FILTER_LUTS:
+            channel_lut = np.array(COLOR_FILTER_LUTS[color_filter], dtype=np.uint8).reshape(3, 256)
+        else:
+            matrix, bias = COLOR_FILTER_MATRICES[color_filter]
+            use_matrix = True
+    if saturation != 1.0:
+        print(f"  - Adjusting saturation: {saturation}")
+    saturation = np.float32(saturation)
+
+    fg = np.asarray(image)
+    tone_lut = IDENTITY_LUT
+    if brightness != 1.0 or contrast != 1.0:
+        if brightness != 1.0:
+            print(f"  - Adjusting brightness: {brightness}")
+        if contrast != 1.0:
+            print(f"  - Adjusting contrast: {contrast}")
+        histogram = None
+        if contrast != 1.0:
+            bright_lut = np.array(build_tone_lut(image, brightness), dtype=np.uint8)
+            with _KERNEL_LOCK:
+                histogram = _adjusted_histogram(fg, channel_lut, matrix, bias, use_matrix,
+                                                saturation, bright_lut)
+        tone_lut = build_tone_lut(image, brightness, contrast, histogram)
+
+    if isinstance(bg, Image.Image):
+        bg = np.asarray(bg)
+    else:
+        bg = np.array(bg[:3], dtype=np.uint8).reshape(1, 1, 3)
+
+    out = np.empty(fg.shape[:2] + (len(output_mode),), dtype=np.uint8)
+    with _KERNEL_LOCK:
+        _finish_pixels(fg, channel_lut, matrix, bias, use_matrix, saturation,
+                       np.array(tone_lut, dtype=np.uint8), bg, out)
+    return Image.fromarray(out, output_mode)
+
+
+def save_image(image, output_path, save_format, **save_kwargs):
+    """Save an image, shrinking JPEG output losslessly with mozjpeg when available.
+
+    Args:
+        image: PIL Image to save
+        output_path: Path for the output file
+        save_format: Pillow format name
+        **save_kwargs: Format-specific options passed to Image.save
+    """
+    if save_format != 'JPEG' or not HAS_MOZJPEG:
+        image.save(output_path, format=save_format, **save_kwargs)
+        return
+
+    buffer = BytesIO()
+    image.save(buffer, format=save_format, **save_kwargs)
+    with open(output_path, 'wb') as output_file:
+        output_file.write(mozjpeg_lossless_optimization.optimize(buffer.getvalue()))
+
+
 def process_image(input_path, output_path, background_color=None, background_image=None,
                   output_format='PNG', model='u2net', alpha_matting=False,
                   mask_only=False, brightness=1.0, contrast=1.0, sharpness=1.0,
                   feather=0, resize_width=None, resize_height=None, resize_scale=None,
                   maintain_aspect=True, quality=90, color_filter=None, saturation=1.0,
-                  progressive=False, strip_metadata=False):
+                  progressive=False, strip_metadata=False, half_size=False,
+                  background_resample='bilinear', compression_effort='fast',
+                  session=None, decoded=None, mask=None, lossless=False,
+                  resize_resample='lanczos'):
     """Process a single image: remove and replace background with enhancements.
 
     Args:
@@ -332,6 +1067,15 @@ def process_image(input_path, output_path, background_color=None, background_ima
         quality: Output quality for lossy formats (1-100)
         color_filter: Color filter preset (warm, cool, cold, sepia, vintage, vibrant, muted)
         saturation: Saturation adjustment factor
+        half_size: Decode RAW input at half resolution (fast previews)
+        background_resample: Filter for resizing the background image
+                             (nearest, bilinear, bicubic, lanczos)
+        compression_effort: Encoder effort for PNG/WebP ('fast' or 'max')
+        session: Preloaded rembg session shared across images
+        decoded: (image, source_size) already returned by decode_image
+        mask: Mask already predicted for the image (see predict_masks)
+        lossless: Encode WebP output losslessly
+        resize_resample: Filter for resizing the output (default: lanczos)
 
     Returns:
         Path to output file
@@ -340,37 +1084,63 @@ def process_image(input_path, output_path, background_color=None, background_ima
     print(f"Processing: {input_path}")
     print(f"{'='*60}")
 
-    # Read image
-    image = read_image(input_path)
+    # Read image, decoding RAW and JPEG input close to the requested output size
+    if decoded is None:
+        decoded = decode_image(input_path, resize_width, resize_height,
+                               resize_scale, half_size)
+    image, source_size = decoded
 
     # Remove background
     no_bg_image = remove_background(image, model=model, alpha_matting=alpha_matting,
-                                    mask_only=mask_only)
+                                    mask_only=mask_only, session=session, mask=mask)
 
-    # If mask only, save and return
+    # If mask only, save the single-channel mask and return before any
+    # filtering, compositing or resizing
     if mask_only:
         print(f"Saving mask to: {output_path}")
-        no_bg_image.save(output_path, format=output_format)
+        save_format = 'JPEG' if output_format.upper() in ['JPG', 'JPEG'] else output_format.upper()
+        save_kwargs = {}
+        if save_format in ['JPEG', 'WEBP', 'AVIF']:
+            save_kwargs['quality'] = quality
+        if save_format == 'WEBP':
+            save_kwargs['lossless'] = lossless
+        save_image(no_bg_image, output_path, save_format, **save_kwargs)
         return output_path
 
-    # Apply color filters
-    if color_filter or saturation != 1.0:
-        print("Applying color filters...")
-        no_bg_image = apply_color_filter(no_bg_image, color_filter, saturation)
-
-    # Apply enhancements
-    if brightness != 1.0 or contrast != 1.0 or sharpness != 1.0 or feather > 0:
-        print("Applying enhancements...")
-        no_bg_image = enhance_image(no_bg_image, brightness, contrast, sharpness, feather)
-
-    # Replace background
-    final_image = replace_background(no_bg_image, background_color, background_image)
+    # JPEG has no alpha channel, so composite straight to RGB; the resize and
+    # save below then work on three channels instead of converting later
+    output_mode = 'RGB' if output_format.upper() in ['JPG', 'JPEG'] else 'RGBA'
+
+    # Without sharpening, which needs neighboring pixels, every step up to the
+    # composite is per-pixel and runs as one fused kernel
+    final_image = None
+    if _finish_pixels is not None and sharpness == 1.0:
+        print("Applying adjustments and background in one pass...")
+        final_image = finish_image(no_bg_image, color_filter, saturation, brightness,
+                                   contrast, feather, background_color, background_image,
+                                   background_resample, output_mode)
+
+    if final_image is None:
+        # Apply color filters
+        if color_filter or saturation != 1.0:
+            print("Applying color filters...")
+            no_bg_image = apply_color_filter(no_bg_image, color_filter, saturation)
+
+        # Apply enhancements
+        if brightness != 1.0 or contrast != 1.0 or sharpness != 1.0 or feather > 0:
+            print("Applying enhancements...")
+            no_bg_image = enhance_image(no_bg_image, brightness, contrast, sharpness, feather)
+
+        # Replace background
+        final_image = replace_background(no_bg_image, background_color, background_image,
+                                         background_resample, output_mode)
 
     # Apply resizing if specified
     if resize_width or resize_height or resize_scale:
         print("Resizing image...")
         final_image = resize_image(final_image, resize_width, resize_height,
-                                   resize_scale, maintain_aspect)
+                                   resize_scale, maintain_aspect, source_size,
+                                   resize_resample)
 
     # Prepare format-specific save options
     save_kwargs = {}
@@ -381,7 +1151,8 @@ def process_image(input_path, output_path, background_color=None, background_ima
 
     # Convert image based on format requirements
     if output_format_upper in ['JPG', 'JPEG']:
-        final_image = final_image.convert('RGB')
+        if final_image.mode != 'RGB':
+            final_image = final_image.convert('RGB')
         save_kwargs['quality'] = quality
         save_kwargs['optimize'] = True
         if progressive:
@@ -390,22 +1161,25 @@ def process_image(input_path, output_path, background_color=None, background_ima
     elif output_format_upper == 'WEBP':
         # WebP supports both RGB and RGBA
         save_kwargs['quality'] = quality
-        save_kwargs['method'] = 6  # Better compression
+        save_kwargs['method'] = WEBP_METHODS[compression_effort]
+        save_kwargs['lossless'] = lossless
     elif output_format_upper == 'AVIF':
         # AVIF supports both RGB and RGBA
         save_kwargs['quality'] = quality
         save_kwargs['speed'] = 6  # Balance between speed and compression
     elif output_format_upper == 'PNG':
-        save_kwargs['optimize'] = True
+        # Trying every zlib strategy is several times slower, so only
+        # spend it when maximum compression is asked for
+        save_kwargs['optimize'] = compression_effort == 'max'
 
     # Strip metadata if requested
     if strip_metadata:
-        save_kwargs['exif'] = b''
+        save_kwargs.update(STRIPPED_METADATA)
         print("  - Metadata stripped for privacy/optimization")
 
     # Save result
     print(f"Saving as {output_format_upper} (quality: {quality})...")
-    final_image.save(output_path, format=save_format, **save_kwargs)
+    save_image(final_image, output_path, save_format, **save_kwargs)
     print(f"Saved to: {output_path}")
 
     return output_path
@@ -415,7 +1189,10 @@ def generate_responsive_images(input_path, output_dir, background_color=None, ba
                                output_format='WEBP', model='u2net', alpha_matting=False,
                                brightness=1.0, contrast=1.0, sharpness=1.0, feather=0,
                                color_filter=None, saturation=1.0, quality=90,
-                               breakpoints=None, progressive=False, strip_metadata=False):
+                               breakpoints=None, progressive=False, strip_metadata=False,
+                               half_size=False, background_resample='bilinear',
+                               compression_effort='fast', session=None, lossless=False,
+                               resize_resample='lanczos'):
     """Generate responsive image set at multiple breakpoints.
 
     Args:
@@ -436,9 +1213,11 @@ def generate_responsive_images(input_path, output_dir, background_color=None, ba
     print(f"Breakpoints: {breakpoints}")
     print(f"{'='*60}")
 
-    # Read and process image once
-    image = read_image(input_path)
-    no_bg_image = remove_background(image, model=model, alpha_matting=alpha_matting, mask_only=False)
+    # Read and process image once, decoding RAW and JPEG input no larger
+    # than the biggest breakpoint needs
+    image, _ = decode_image(input_path, width=max(breakpoints), half_size=half_size)
+    no_bg_image = remove_background(image, model=model, alpha_matting=alpha_matting,
+                                    mask_only=False, session=session)
 
     # Apply color filters
     if color_filter or saturation != 1.0:
@@ -450,8 +1229,16 @@ def generate_responsive_images(input_path, output_dir, background_color=None, ba
         print("Applying enhancements...")
         no_bg_image = enhance_image(no_bg_image, brightness, contrast, sharpness, feather)
 
-    # Replace background
-    final_image = replace_background(no_bg_image, background_color, background_image)
+    # The cutout stays transparent through the resizes and each breakpoint is
+    # composited against a background of its own size, so the background is
+    # never built or resampled at full resolution. The background image is
+    # decoded once for all breakpoints and all files in the batch.
+    if background_image:
+        print(f"Using background image: {background_image}")
+        background_image = load_background(background_image)
+
+    # JPEG has no alpha channel, so breakpoints are composited straight to RGB
+    output_mode = 'RGB' if output_format.upper() in ['JPG', 'JPEG'] else 'RGBA'
 
     # Generate images at each breakpoint
     generated_files = []
@@ -459,21 +1246,30 @@ def generate_responsive_images(input_path, output_dir, background_color=None, ba
     output_dir_path = Path(output_dir)
     output_dir_path.mkdir(parents=True, exist_ok=True)
 
-    for width in breakpoints:
+    # Work from the largest breakpoint down, resizing each output from the
+    # previous one so every LANCZOS pass reads a progressively smaller source
+    current = no_bg_image
+    for width in sorted(breakpoints, reverse=True):
         # Skip if original is smaller than breakpoint
-        if final_image.size[0] < width:
-            print(f"  - Skipping {width}px (original is {final_image.size[0]}px)")
+        if no_bg_image.size[0] < width:
+            print(f"  - Skipping {width}px (original is {no_bg_image.size[0]}px)")
             continue
 
-        # Resize for this breakpoint
-        resized = resize_image(final_image.copy(), width=width)
+        # Resize for this breakpoint (a breakpoint equal to the current width
+        # needs no resampling)
+        if current.size[0] != width:
+            current = resize_image(current, width=width, resample=resize_resample)
+
+        # Replace background
+        resized = replace_background(current, background_color, background_image,
+                                     background_resample, output_mode)
 
         # Generate filename with width suffix
         output_name = f"{input_name}_{width}w.{output_format.lower()}"
         output_path = output_dir_path / output_name
 
         # Prepare save options
-        save_kwargs = {'optimize': True}
+        save_kwargs = {}
         output_format_upper = output_format.upper()
 
         # Normalize format name for Pillow (requires 'JPEG' not 'JPG')
@@ -481,33 +1277,38 @@ def generate_responsive_images(input_path, output_dir, background_color=None, ba
 
         # Format-specific options
         if output_format_upper in ['JPG', 'JPEG']:
-            resized_save = resized.convert('RGB')
+            resized_save = resized if resized.mode == 'RGB' else resized.convert('RGB')
             save_kwargs['quality'] = quality
+            save_kwargs['optimize'] = True
             if progressive:
                 save_kwargs['progressive'] = True
                 print(f"  - {width}px: Progressive JPEG enabled")
         elif output_format_upper == 'WEBP':
             resized_save = resized
             save_kwargs['quality'] = quality
-            save_kwargs['method'] = 6
+            save_kwargs['method'] = WEBP_METHODS[compression_effort]
+            save_kwargs['lossless'] = lossless
         elif output_format_upper == 'AVIF':
             resized_save = resized
             save_kwargs['quality'] = quality
             save_kwargs['speed'] = 6
         elif output_format_upper == 'PNG':
             resized_save = resized
+            save_kwargs['optimize'] = compression_effort == 'max'
         else:
             resized_save = resized
 
         # Strip metadata if requested
         if strip_metadata:
-            save_kwargs['exif'] = b''
+            save_kwargs.update(STRIPPED_METADATA)
 
         # Save
-        resized_save.save(output_path, format=save_format, **save_kwargs)
+        save_image(resized_save, output_path, save_format, **save_kwargs)
         print(f"  - Generated: {output_name} ({resized.size[0]}x{resized.size[1]})")
         generated_files.append(str(output_path))
 
+    # Report files smallest-first
+    generated_files.reverse()
     return generated_files
 
 
@@ -517,9 +1318,11 @@ def parse_color(color_string):
         # Hex color
         color_string = color_string.lstrip('#')
         if len(color_string) == 6:
-            return tuple(int(color_string[i:i+2], 16) for i in (0, 2, 4)) + (255,)
+            value = int(color_string, 16)
+            return (value >> 16 & 0xFF, value >> 8 & 0xFF, value & 0xFF, 255)
         elif len(color_string) == 8:
-            return tuple(int(color_string[i:i+2], 16) for i in (0, 2, 4, 6))
+            value = int(color_string, 16)
+            return (value >> 24 & 0xFF, value >> 16 & 0xFF, value >> 8 & 0xFF, value & 0xFF)
     else:
         # Named colors or comma-separated RGB/RGBA
         if ',' in color_string:
@@ -529,19 +1332,323 @@ def parse_color(color_string):
             elif len(values) == 4:
                 return tuple(values)
 
-    # Common named colors
-    colors = {
-        'white': (255, 255, 255, 255),
-        'black': (0, 0, 0, 255),
-        'red': (255, 0, 0, 255),
-        'green': (0, 255, 0, 255),
-        'blue': (0, 0, 255, 255),
-        'yellow': (255, 255, 0, 255),
-        'cyan': (0, 255, 255, 255),
-        'magenta': (255, 0, 255, 255),
-    }
+    return NAMED_COLORS.get(color_string.lower(), (255, 255, 255, 255))
+
+
+def iter_input_files(patterns):
+    """Yield the input image paths named on the command line.
+
+    Directories are scanned with os.scandir for supported image files, and
+    anything else is expanded as a glob pattern or taken as a literal path.
+
+    Args:
+        patterns: Input arguments (files, glob patterns or directories)
+
+    Yields:
+        Input file paths
+    """
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            with os.scandir(pattern) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(INPUT_EXTENSIONS):
+                        yield entry.path
+            continue
+
+        matched = False
+        for path in iglob(pattern):
+            matched = True
+            yield path
+        if not matched and os.path.exists(pattern):
+            yield pattern
+
+
+def has_transparent_background(bg_color=None, bg_image=None):
+    """Check whether output composited over the background keeps any transparency.
+
+    Without a color or image the background is opaque white. bg_image may be
+    a file path or an already opened RGBA image; either is checked at its
+    own size, without resizing it to the foreground.
+    """
+    if bg_image:
+        if isinstance(bg_image, Image.Image):
+            return bg_image.getchannel('A').getextrema()[0] < 255
+        try:
+            return load_background(bg_image).getchannel('A').getextrema()[0] < 255
+        except OSError:
+            # An unreadable background is reported for each file instead
+            return False
+    return bool(bg_color) and len(bg_color) == 4 and bg_color[3] < 255
+
+
+def get_output_path(input_file, args, output=None):
+    """Return the output path for an input file outside responsive mode.
+
+    Args:
+        input_file: Path to input image
+        args: Parsed command-line arguments
+        output: Explicit output path (single-file runs only)
+
+    Returns:
+        Output path
+    """
+    if output:
+        return Path(output)
+
+    input_path = Path(input_file)
+    output_name = f"{input_path.stem}{args.suffix}.{args.format.lower()}"
 
-    return colors.get(color_string.lower(), (255, 255, 255, 255))
+    if args.output_dir:
+        # Created once in main() before any file is processed
+        return Path(args.output_dir) / output_name
+    return input_path.parent / output_name
+
+
+def is_up_to_date(input_file, output_path):
+    """Check whether output_path exists and is no older than input_file."""
+    try:
+        return Path(output_path).stat().st_mtime >= Path(input_file).stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def process_file(input_file, args, bg_color=None, breakpoints=None, output=None,
+                 session=None, decoded=None, mask=None):
+    """Process one input file from the command line, reporting any error.
+
+    Args:
+        input_file: Path to input image
+        args: Parsed command-line arguments
+        bg_color: Parsed background color tuple (R,G,B,A)
+        breakpoints: Parsed responsive breakpoints
+        output: Explicit output path (single-file runs only)
+        session: Preloaded rembg session shared across the batch
+        decoded: (image, source_size) already returned by decode_image
+        mask: Mask already predicted for the image (see predict_masks)
+    """
+    if session is None:
+        # Worker processes load the session for the requested precision
+        session = get_session(args.model, args.quant)
+
+    try:
+        # Handle responsive image generation
+        if args.responsive:
+            # Determine output directory for responsive images
+            if args.output_dir:
+                output_dir = Path(args.output_dir)
+            else:
+                output_dir = Path(input_file).parent / "responsive"
+
+            # Generate responsive images
+            generated_files = generate_responsive_images(
+                input_file,
+                str(output_dir),
+                background_color=bg_color,
+                background_image=args.bg_image,
+                output_format=args.format,
+                model=args.model,
+                alpha_matting=args.alpha_matting,
+                brightness=args.brightness,
+                contrast=args.contrast,
+                sharpness=args.sharpness,
+                feather=args.feather,
+                color_filter=args.filter,
+                saturation=args.saturation,
+                quality=args.quality,
+                breakpoints=breakpoints,
+                progressive=args.progressive,
+                strip_metadata=args.strip_metadata,
+                half_size=args.half_size,
+                background_resample=args.bg_resample,
+                compression_effort=args.compression_effort,
+                session=session,
+                lossless=args.lossless,
+                resize_resample=args.resample
+            )
+            print(f"Generated {len(generated_files)} responsive images in {output_dir}")
+        else:
+            # Regular single image processing
+            output_path = get_output_path(input_file, args, output)
+            if args.skip_existing and is_up_to_date(input_file, output_path):
+                print(f"Skipping {input_file}: {output_path} is up to date")
+                return
+
+            # Process image
+            process_image(
+                input_file,
+                str(output_path),
+                background_color=bg_color,
+                background_image=args.bg_image,
+                output_format=args.format,
+                model=args.model,
+                alpha_matting=args.alpha_matting,
+                mask_only=args.mask_only,
+                brightness=args.brightness,
+                contrast=args.contrast,
+                sharpness=args.sharpness,
+                feather=args.feather,
+                resize_width=args.width,
+                resize_height=args.height,
+                resize_scale=args.scale,
+                maintain_aspect=not args.no_aspect,
+                quality=args.quality,
+                color_filter=args.filter,
+                saturation=args.saturation,
+                progressive=args.progressive,
+                strip_metadata=args.strip_metadata,
+                half_size=args.half_size,
+                background_resample=args.bg_resample,
+                compression_effort=args.compression_effort,
+                session=session,
+                decoded=decoded,
+                mask=mask,
+                lossless=args.lossless,
+                resize_resample=args.resample
+            )
+
+    except Exception:
+        logger.exception("Error processing %s", input_file)
+
+
+def process_batch(input_files, args, bg_color=None, session=None):
+    """Process a group of input files, segmenting them in a single batch.
+
+    Every file in the group is decoded before segmentation and kept at full
+    size until it is saved, so memory use grows with the batch size.
+
+    Args:
+        input_files: Paths to input images
+        args: Parsed command-line arguments
+        bg_color: Parsed background color tuple (R,G,B,A)
+        session: Preloaded rembg session shared across the batch
+    """
+    batch = []
+    for input_file in input_files:
+        if args.skip_existing and is_up_to_date(input_file, get_output_path(input_file, args)):
+            print(f"Skipping {input_file}: output is up to date")
+            continue
+        try:
+            batch.append((input_file, decode_image(input_file, args.width, args.height,
+                                                   args.scale, args.half_size)))
+        except Exception:
+            logger.exception("Error processing %s", input_file)
+
+    images = [image for _, (image, _) in batch]
+    try:
+        masks = predict_masks(images, session)
+    except Exception as e:
+        # Leave each image to be segmented on its own in process_image
+        logger.warning("Batched segmentation failed, segmenting images one at a time: %s", e)
+        masks = [None] * len(batch)
+
+    for (input_file, decoded), mask in zip(batch, masks):
+        process_file(input_file, args, bg_color, session=session,
+                     decoded=decoded, mask=mask)
+
+
+def iter_completed(executor, fn, items, limit, *args):
+    """Run fn(item, *args) on executor with at most limit calls in flight.
+
+    Items are taken from the iterable only as earlier calls finish, so a
+    lazily discovered list of input files is never drained up front.
+
+    Args:
+        executor: concurrent.futures executor to submit the calls to
+        fn: Function called with each item followed by args
+        items: Iterable of items
+        limit: Maximum number of submitted calls not yet finished
+
+    Yields:
+        (item, future) for each call as it finishes
+    """
+    items = iter(items)
+    pending = {executor.submit(fn, item, *args): item for item in islice(items, limit)}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        # Keep the executor busy before handing the finished calls back
+        for item in islice(items, len(done)):
+            pending[executor.submit(fn, item, *args)] = item
+        for future in done:
+            yield pending.pop(future), future
+
+
+def get_worker_context():
+    """Return the multiprocessing context for batch worker processes.
+
+    Workers are always spawned fresh. CUDA cannot be used from a forked
+    process, and rembg imports pymatting, whose Numba threading layer leaves
+    the parent hanging at exit once it has forked.
+    """
+    return multiprocessing.get_context('spawn')
+
+
+class PerFileOutput:
+    """Stdout stand-in that prints each file's progress lines as one block.
+
+    Files processed side by side on the overlap threads would otherwise
+    interleave their progress lines. Output written inside buffered() is
+    held per thread and written out when the file is done; anything else
+    passes straight through.
+
+    Args:
+        stream: Stream to write to (normally sys.stdout)
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        with self.lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            with self.lock:
+                self.stream.flush()
+
+    @contextlib.contextmanager
+    def buffered(self):
+        """Hold everything the calling thread prints until the block exits."""
+        self.local.buffer = StringIO()
+        try:
+            yield
+        finally:
+            text = self.local.buffer.getvalue()
+            self.local.buffer = None
+            with self.lock:
+                self.stream.write(text)
+                self.stream.flush()
+
+
+def configure_logging():
+    """Send this module's warning and error records to stderr.
+
+    Failures are logged, so a batch with many unreadable files formats each
+    record only when it is emitted; progress messages are printed to stdout.
+    The handler goes on this module's logger only, leaving the log output of
+    rembg, ONNX Runtime and numba as it was.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        logger.addHandler(handler)
+
+
+def init_worker(threads, model, quant='fp32', quiet=False):
+    """Limit ONNX Runtime threads and load the model in a batch worker process."""
+    configure_logging()
+    if quiet:
+        # Silence progress output for the worker's whole lifetime. print()
+        # does nothing while sys.stdout is None, so no file is left open.
+        sys.stdout = None
+    # rembg reads OMP_NUM_THREADS when it creates a session
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    get_session(model, quant)
 
 
 def main():
@@ -613,22 +1720,34 @@ Available Formats:
   JPG/JPEG: Lossy compression, no transparency (photos)
   WEBP: Modern format, transparency support, excellent compression
   AVIF: Next-gen format, best compression, transparency support
+
+  Without --format, the extension of -o picks the format. Otherwise masks and
+  transparent backgrounds are saved as lossless WEBP and everything else as
+  progressive JPG. Earlier versions always defaulted to PNG; pass --format PNG
+  to keep that behavior.
         """
     )
 
     # Input/Output arguments
-    parser.add_argument('input', nargs='+', help='Input image file(s)')
+    parser.add_argument('input', nargs='+', help='Input image file(s), glob pattern(s) or directories')
     parser.add_argument('-o', '--output', help='Output file path (for single file)')
     parser.add_argument('-d', '--output-dir', help='Output directory (for multiple files)')
-    parser.add_argument('-f', '--format', default='PNG', choices=['PNG', 'JPG', 'JPEG', 'WEBP', 'AVIF'],
-                        help='Output format (default: PNG)')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS,
+                        help='Output format (default: lossless WEBP for masks and transparent '
+                             'backgrounds, progressive JPG otherwise)')
     parser.add_argument('--suffix', default='_no_bg', help='Suffix for output files (default: _no_bg)')
+    parser.add_argument('--skip-existing', action='store_true',
+                        help='Skip input files whose output already exists and is newer')
     parser.add_argument('-q', '--quality', type=int, default=90,
                         help='Output quality for lossy formats JPG/WEBP/AVIF (1-100, default: 90)')
+    parser.add_argument('--lossless', action='store_true',
+                        help='Encode WebP output losslessly')
 
     # Background options
     parser.add_argument('-c', '--color', help='Background color (hex like #FFFFFF or RGB like 255,255,255 or name like white)')
     parser.add_argument('-b', '--bg-image', help='Background image file')
+    parser.add_argument('--bg-resample', default='bilinear', choices=list(RESAMPLE_FILTERS),
+                        help='Filter for resizing the background image (default: bilinear)')
 
     # Model and processing options
     parser.add_argument('-m', '--model', default='u2net',
@@ -637,6 +1756,8 @@ Available Formats:
                         help='Enable alpha matting for better edge refinement')
     parser.add_argument('--mask-only', action='store_true',
                         help='Output only the segmentation mask')
+    parser.add_argument('--quant', default='fp32', choices=['fp32', 'int8'],
+                        help='Model weight precision; int8 is faster on CPU, U2-Net models only (default: fp32)')
 
     # Image enhancement options
     parser.add_argument('--brightness', type=float, default=1.0,
@@ -663,6 +1784,8 @@ Available Formats:
                         help='Resize by scale factor (e.g., 0.5 for 50%%, 2.0 for 200%%)')
     parser.add_argument('--no-aspect', action='store_true',
                         help='Do not maintain aspect ratio when both width and height specified')
+    parser.add_argument('--resample', default='lanczos', choices=list(RESAMPLE_FILTERS),
+                        help='Filter for resizing the output (default: lanczos, bilinear is faster)')
 
     # Web optimization options
     parser.add_argument('--progressive', action='store_true',
@@ -671,24 +1794,76 @@ Available Formats:
                         help='Remove all EXIF/metadata from output for privacy and smaller file size')
     parser.add_argument('--web-optimized', action='store_true',
                         help='Apply web optimization preset (progressive JPEG, strip metadata, optimized compression)')
+    parser.add_argument('--compression-effort', choices=['fast', 'max'],
+                        help='PNG/WebP encoder effort (default: fast, or max with --web-optimized)')
     parser.add_argument('--responsive', action='store_true',
                         help='Generate responsive image set at multiple breakpoints')
     parser.add_argument('--breakpoints', type=str,
                         help='Custom responsive breakpoints as comma-separated widths (e.g., "640,1024,1920")')
 
+    # Performance options
+    parser.add_argument('--half-size', action='store_true',
+                        help='Decode RAW files at half resolution for fast previews')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to process in parallel, 0 for one per CPU core (default: 1)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Only report errors, without per-file progress output')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Number of images segmented per model run for U2-Net models; each image '
+                             'in a batch is held in memory at full size (default: 1)')
+
     args = parser.parse_args()
+    configure_logging()
+
+    # Without --format the output file's extension picks the format, so an
+    # extension no format matches would get data it does not describe
+    output_suffix = Path(args.output).suffix[1:].upper() if args.output else ''
+    if args.output and args.format is None and output_suffix not in OUTPUT_FORMATS:
+        parser.error(f"cannot tell the output format from '{args.output}': use a .png, .jpg, "
+                     ".webp or .avif file name, or pass --format")
+
+    if args.quiet:
+        # Progress messages are printed, so discard stdout for the whole run
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run(args)
+    else:
+        run(args)
 
+
+def run(args):
+    """Process the input files named by parsed command-line arguments."""
     # Parse background color
     bg_color = None
     if args.color:
         bg_color = parse_color(args.color)
         print(f"Background color: {bg_color}")
 
+    # Choose the output format when none is given. Masks and output over a
+    # transparent background go to lossless WebP, which keeps them exact in
+    # much less space and encode time than PNG. Everything else, including
+    # the default white background, is an opaque photo and goes to JPEG.
+    if args.format is None and args.output:
+        # An explicit output file name already says which format to write
+        # (main() rejects names without a known extension)
+        args.format = Path(args.output).suffix[1:].upper()
+    elif args.format is None:
+        if args.mask_only or has_transparent_background(bg_color, args.bg_image):
+            args.format = 'WEBP'
+            args.lossless = True
+        else:
+            args.format = 'JPG'
+            args.progressive = True
+        print(f"Output format: {args.format}")
+
     # Apply web-optimized preset
     if args.web_optimized:
         args.progressive = True
         args.strip_metadata = True
-        print("Web optimization preset enabled (progressive + metadata stripping)")
+        if args.compression_effort is None:
+            args.compression_effort = 'max'
+        print("Web optimization preset enabled (progressive + metadata stripping + max compression)")
+    elif args.compression_effort is None:
+        args.compression_effort = 'fast'
 
     # Parse responsive breakpoints
     breakpoints = None
@@ -697,105 +1872,80 @@ Available Formats:
             breakpoints = [int(w.strip()) for w in args.breakpoints.split(',')]
             print(f"Custom breakpoints: {breakpoints}")
         except ValueError:
-            print("Error: Invalid breakpoints format. Use comma-separated integers (e.g., '640,1024,1920')")
+            logger.error("Invalid breakpoints format. Use comma-separated integers (e.g., '640,1024,1920')")
             sys.exit(1)
 
-    # Process files
-    input_files = []
-    for pattern in args.input:
-        from glob import glob
-        matched = glob(pattern)
-        if matched:
-            input_files.extend(matched)
-        elif os.path.exists(pattern):
-            input_files.append(pattern)
-
-    if not input_files:
-        print("Error: No input files found!")
+    # Process files as they are discovered. Peeking at the first two is
+    # enough to tell a single-file run, where -o applies, from a batch.
+    input_files = iter_input_files(args.input)
+    first_files = list(islice(input_files, 2))
+
+    if not first_files:
+        logger.error("No input files found!")
         sys.exit(1)
 
-    print(f"Found {len(input_files)} file(s) to process")
+    single_file = len(first_files) == 1
+    input_files = chain(first_files, input_files)
+    if single_file:
+        print("Found 1 file to process")
+    else:
+        print("Processing input files as they are found")
 
-    # Process each file
-    for input_file in input_files:
-        try:
-            # Handle responsive image generation
-            if args.responsive:
-                # Determine output directory for responsive images
-                if args.output_dir:
-                    output_dir = Path(args.output_dir)
-                else:
-                    output_dir = Path(input_file).parent / "responsive"
-
-                output_dir.mkdir(parents=True, exist_ok=True)
-
-                # Generate responsive images
-                generated_files = generate_responsive_images(
-                    input_file,
-                    str(output_dir),
-                    background_color=bg_color,
-                    background_image=args.bg_image,
-                    output_format=args.format,
-                    model=args.model,
-                    alpha_matting=args.alpha_matting,
-                    brightness=args.brightness,
-                    contrast=args.contrast,
-                    sharpness=args.sharpness,
-                    feather=args.feather,
-                    color_filter=args.filter,
-                    saturation=args.saturation,
-                    quality=args.quality,
-                    breakpoints=breakpoints,
-                    progressive=args.progressive,
-                    strip_metadata=args.strip_metadata
-                )
-                print(f"Generated {len(generated_files)} responsive images in {output_dir}")
-            else:
-                # Regular single image processing
-                # Determine output path
-                if len(input_files) == 1 and args.output:
-                    output_path = args.output
-                else:
-                    input_path = Path(input_file)
-                    output_name = f"{input_path.stem}{args.suffix}.{args.format.lower()}"
-
-                    if args.output_dir:
-                        output_dir = Path(args.output_dir)
-                        output_dir.mkdir(parents=True, exist_ok=True)
-                        output_path = output_dir / output_name
-                    else:
-                        output_path = input_path.parent / output_name
-
-                # Process image
-                process_image(
-                    input_file,
-                    str(output_path),
-                    background_color=bg_color,
-                    background_image=args.bg_image,
-                    output_format=args.format,
-                    model=args.model,
-                    alpha_matting=args.alpha_matting,
-                    mask_only=args.mask_only,
-                    brightness=args.brightness,
-                    contrast=args.contrast,
-                    sharpness=args.sharpness,
-                    feather=args.feather,
-                    resize_width=args.width,
-                    resize_height=args.height,
-                    resize_scale=args.scale,
-                    maintain_aspect=not args.no_aspect,
-                    quality=args.quality,
-                    color_filter=args.filter,
-                    saturation=args.saturation,
-                    progressive=args.progressive,
-                    strip_metadata=args.strip_metadata
-                )
+    # Create the output directory once rather than for every file
+    if args.output_dir:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
 
-        except Exception as e:
-            print(f"Error processing {input_file}: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
+    # Process each file
+    output = args.output if single_file else None
+    # The pool starts workers only as files are submitted, so a short batch
+    # never loads more model sessions than it has files
+    jobs = 1 if single_file else args.jobs or os.cpu_count() or 1
+    if jobs > 1:
+        # Each worker process loads its own model session, so split the
+        # CPU cores between them to keep ONNX Runtime from oversubscribing
+        threads = max(1, (os.cpu_count() or 1) // jobs)
+        print(f"Processing with up to {jobs} parallel workers ({threads} threads each)")
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=get_worker_context(),
+                                 initializer=init_worker,
+                                 initargs=(threads, args.model, args.quant,
+                                           args.quiet)) as executor:
+            # Queue a couple of files per worker so none sits idle, while
+            # still discovering the rest only as they are needed
+            completed = iter_completed(executor, process_file, input_files, jobs * 2,
+                                       args, bg_color, breakpoints, output)
+            # process_file reports its own errors; this catches workers that
+            # died outright (e.g. killed for running out of memory)
+            for input_file, future in completed:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error("Error processing %s: worker failed: %s", input_file, e)
+    else:
+        # Load the model once up front and share it across every file
+        session = get_session(args.model, args.quant)
+        if (args.batch_size > 1 and output is None and not args.responsive
+                and not args.alpha_matting and supports_batching(session)):
+            while True:
+                batch = list(islice(input_files, args.batch_size))
+                if not batch:
+                    break
+                process_batch(batch, args, bg_color, session)
+        elif single_file:
+            process_file(next(input_files), args, bg_color, breakpoints, output, session)
+        else:
+            # Files are processed side by side, so print each file's progress
+            # in one piece once it is done
+            stdout = PerFileOutput(sys.stdout)
+
+            def process(input_file):
+                with stdout.buffered():
+                    process_file(input_file, args, bg_color, breakpoints, output, session)
+
+            with contextlib.redirect_stdout(stdout):
+                with ThreadPoolExecutor(max_workers=OVERLAP_THREADS) as executor:
+                    for _, future in iter_completed(executor, process, input_files,
+                                                    OVERLAP_THREADS * 2):
+                        future.result()
 
     print(f"\n{'='*60}")
     print("Processing complete!")
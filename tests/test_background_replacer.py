@@ -0,0 +1,198 @@
+"""Tests for the numpy and numba fast paths and the batch file helpers."""
+
+import os
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('rawpy')
+pytest.importorskip('rembg')
+
+import background_replacer as br
+
+
+def random_image(mode, size, seed):
+    """Return a random image, with fully transparent and opaque columns for RGBA."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size[1], size[0], len(mode)), dtype=np.uint8)
+    if mode == 'RGBA':
+        pixels[:, :10, 3] = 0
+        pixels[:, 10:20, 3] = 255
+    return Image.fromarray(pixels, mode)
+
+
+@pytest.fixture
+def foreground():
+    return random_image('RGBA', (64, 48), seed=1)
+
+
+@pytest.fixture
+def background_image():
+    return random_image('RGB', (40, 30), seed=2).convert('RGBA')
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'RGB'])
+@pytest.mark.parametrize('use_image', [False, True])
+def test_composite_over_opaque_matches_alpha_composite(foreground, background_image,
+                                                       mode, use_image):
+    if use_image:
+        background = background_image.resize(foreground.size)
+        reference_bg = background
+    else:
+        background = (200, 100, 50)
+        reference_bg = Image.new('RGBA', foreground.size, background + (255,))
+
+    result = br.composite_over_opaque(foreground, background, mode)
+    reference = Image.alpha_composite(reference_bg, foreground).convert(mode)
+
+    assert result.mode == mode
+    np.testing.assert_array_equal(np.asarray(result), np.asarray(reference))
+
+
+@pytest.mark.parametrize('size, bounds', [
+    ((51, 204), (100, 30)),   # round() would give 8x30, thumbnail() 7x30
+    ((640, 480), (200, 200)),
+    ((120, 80), (400, 300)),  # already fits, left alone
+])
+def test_resize_image_fits_like_thumbnail(size, bounds):
+    image = Image.new('RGB', size)
+    expected = image.copy()
+    expected.thumbnail(bounds)
+
+    assert br.resize_image(image, *bounds).size == expected.size
+
+
+@pytest.mark.skipif(not br.HAS_CV2, reason='requires opencv')
+@pytest.mark.parametrize('feather', [1, 3, br.CV2_MAX_FEATHER])
+def test_feather_with_opencv_matches_pil(monkeypatch, feather):
+    # A subject cut off by the bottom edge, as in a portrait
+    alpha = np.zeros((90, 120), dtype=np.uint8)
+    alpha[20:, 30:90] = 255
+    image = Image.new('RGB', (120, 90), (200, 150, 100))
+    image.putalpha(Image.fromarray(alpha))
+
+    with_cv2 = br.enhance_image(image, feather=feather)
+    monkeypatch.setattr(br, 'HAS_CV2', False)
+    with_pil = br.enhance_image(image, feather=feather)
+
+    difference = np.abs(np.asarray(with_cv2, dtype=np.int16) - np.asarray(with_pil, dtype=np.int16))
+    assert difference.max() <= 6
+
+
+def staged_finish(image, color_filter, saturation, brightness, contrast, feather,
+                  background_color, background_image, output_mode):
+    """Run the separate stages process_image uses when finish_image does not apply."""
+    staged = br.apply_color_filter(image, color_filter, saturation)
+    staged = br.enhance_image(staged, brightness, contrast, 1.0, feather)
+    return br.replace_background(staged, background_color, background_image, 'bilinear',
+                                 output_mode)
+
+
+# color_filter, saturation, brightness, contrast, feather
+FINISH_CASES = [
+    (None, 1.0, 1.0, 1.0, 0),       # background only
+    ('warm', 1.0, 1.0, 1.0, 0),     # lookup-table filter
+    ('sepia', 1.0, 1.0, 1.0, 0),    # matrix filter
+    (None, 1.7, 1.0, 1.0, 0),       # saturation only
+    ('muted', 0.4, 1.3, 1.0, 0),    # matrix filter, saturation and brightness
+    ('vintage', 1.2, 0.7, 1.5, 0),  # contrast after every other adjustment
+    (None, 1.0, 1.0, 0.6, 3),       # feathered alpha
+]
+
+
+@pytest.mark.skipif(not br.HAS_NUMBA, reason='finish_image requires numba')
+@pytest.mark.parametrize('case', FINISH_CASES)
+@pytest.mark.parametrize('use_image', [False, True])
+@pytest.mark.parametrize('output_mode', ['RGBA', 'RGB'])
+def test_finish_image_matches_staged_pipeline(foreground, background_image, case,
+                                              use_image, output_mode):
+    background_color = None if use_image else (10, 200, 30, 255)
+    background = background_image if use_image else None
+
+    fused = br.finish_image(foreground, *case, background_color, background, 'bilinear',
+                            output_mode)
+    staged = staged_finish(foreground, *case, background_color, background, output_mode)
+
+    assert fused.mode == output_mode
+    np.testing.assert_array_equal(np.asarray(fused), np.asarray(staged))
+
+
+@pytest.mark.skipif(not br.HAS_NUMBA, reason='finish_image requires numba')
+def test_finish_image_one_row_over_background_image(background_image):
+    # A one-row background image must not be mistaken for a solid color
+    image = random_image('RGBA', (20, 1), seed=4)
+    case = ('warm', 1.0, 1.0, 1.0, 0)
+
+    fused = br.finish_image(image, *case, None, background_image, 'bilinear', 'RGB')
+    staged = staged_finish(image, *case, None, background_image, 'RGB')
+
+    np.testing.assert_array_equal(np.asarray(fused), np.asarray(staged))
+
+
+@pytest.mark.skipif(not br.HAS_NUMBA, reason='finish_image requires numba')
+@pytest.mark.parametrize('mode', ['L', 'P', 'RGB'])
+def test_finish_image_converts_other_input_modes(mode):
+    image = random_image('RGB', (32, 24), seed=3).convert(mode)
+    case = ('sepia', 1.2, 1.1, 1.3, 0)
+
+    fused = br.finish_image(image, *case, (255, 255, 255, 255), None, 'bilinear', 'RGB')
+    staged = staged_finish(image.convert('RGBA'), *case, (255, 255, 255, 255), None, 'RGB')
+
+    np.testing.assert_array_equal(np.asarray(fused), np.asarray(staged))
+
+
+@pytest.mark.skipif(not br.HAS_NUMBA, reason='finish_image requires numba')
+def test_finish_image_leaves_translucent_backgrounds_to_staged_path(foreground):
+    assert br.finish_image(foreground, background_color=(0, 0, 0, 128)) is None
+
+
+def test_is_up_to_date(tmp_path):
+    input_file = tmp_path / 'photo.jpg'
+    output_file = tmp_path / 'photo_no_bg.jpg'
+    input_file.write_bytes(b'input')
+
+    assert not br.is_up_to_date(input_file, output_file)
+
+    output_file.write_bytes(b'output')
+    os.utime(input_file, (2000, 2000))
+    os.utime(output_file, (1000, 1000))
+    assert not br.is_up_to_date(input_file, output_file)
+
+    os.utime(output_file, (2000, 2000))
+    assert br.is_up_to_date(input_file, output_file)
+
+
+def test_get_output_path(tmp_path):
+    args = Namespace(suffix='_no_bg', format='WEBP', output_dir=None)
+    input_file = tmp_path / 'shots' / 'IMG_0124.CR3'
+
+    assert br.get_output_path(input_file, args) == tmp_path / 'shots' / 'IMG_0124_no_bg.webp'
+    assert br.get_output_path(input_file, args, 'out.png') == Path('out.png')
+
+    # main() creates the output directory once, so building a path must not
+    args.output_dir = str(tmp_path / 'processed')
+    assert br.get_output_path(input_file, args) == tmp_path / 'processed' / 'IMG_0124_no_bg.webp'
+    assert not (tmp_path / 'processed').exists()
+
+
+def test_iter_completed_keeps_a_bounded_window():
+    taken = []
+
+    def items():
+        for i in range(10):
+            taken.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        completed = br.iter_completed(executor, pow, items(), 3, 2)
+        first_item, first_future = next(completed)
+        # Only the first window plus one refill per finished call is drawn
+        assert len(taken) <= 6
+        results = {first_item: first_future.result()}
+        results.update((item, future.result()) for item, future in completed)
+
+    assert results == {i: i ** 2 for i in range(10)}